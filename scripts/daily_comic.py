@@ -10,112 +10,282 @@ Only requires a single GEMINI_API_KEY.
 """
 
 import argparse
-import json
+import asyncio
 import os
 import sys
 import base64
+import hashlib
+import io
+import json
 import platform
+import random
+import re
 import subprocess
-import tempfile
-import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
 
-import requests
+import httpx
+import numpy as np
+import orjson
 from google import genai
 from google.genai import errors as genai_errors
 from google.genai import types
 from PIL import Image
 
 
-def call_gemini_with_retry(fn, *, label: str, max_attempts: int = 5):
-    """Call a Gemini SDK function, retrying on 429 RESOURCE_EXHAUSTED with exponential backoff.
+def is_rate_limited(e: Exception) -> bool:
+    """True if a Gemini SDK error is a 429 / RESOURCE_EXHAUSTED quota error."""
+    return isinstance(e, genai_errors.APIError) and (
+        e.code == 429 or e.status == "RESOURCE_EXHAUSTED"
+    )
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 60.0) -> float:
+    """Exponential backoff with jitter: min(cap, base * 2**attempt) + U(0, base)."""
+    return min(cap, base * 2 ** attempt) + random.uniform(0, base)
+
 
-    Gemini free-tier quotas reset on a per-minute basis, so a 10s/20s/40s/80s/160s
-    schedule (~5 min total) usually clears transient spikes without failing the daily run.
+class AdaptiveLimiter:
+    """Async concurrency limit that adapts to API responses (AIMD).
+
+    Every 429 halves the number of requests allowed in flight; every success
+    adds one back, up to `max_concurrent`. Used as `async with limiter:`.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self.limit = max_concurrent
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    async def on_success(self):
+        async with self._cond:
+            if self.limit < self.max_concurrent:
+                self.limit += 1
+                self._cond.notify_all()
+
+    async def on_rate_limited(self):
+        async with self._cond:
+            self.limit = max(1, self.limit // 2)
+
+
+async def call_gemini_with_retry_async(
+    fn, *, label: str, limiter: AdaptiveLimiter, max_attempts: int = 5
+):
+    """Call a Gemini aio SDK function, retrying on 429 RESOURCE_EXHAUSTED.
+
+    `fn` must return a fresh awaitable on each call. Each attempt holds a slot
+    in `limiter`; a 429 shrinks the limiter and backs off with jitter
+    (~10s/20s/40s/60s). Gemini free-tier quotas reset per minute, so this
+    usually clears transient spikes without failing the daily run.
     """
-    delay = 10
     for attempt in range(1, max_attempts + 1):
         try:
-            return fn()
-        except genai_errors.ClientError as e:
-            if e.code != 429 or attempt == max_attempts:
+            async with limiter:
+                result = await fn()
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_attempts:
                 raise
-            print(f"  {label}: 429 RESOURCE_EXHAUSTED (attempt {attempt}/{max_attempts}), sleeping {delay}s...")
-            time.sleep(delay)
-            delay *= 2
+            await limiter.on_rate_limited()
+            delay = backoff_delay(attempt - 1, base=10.0)
+            print(f"  {label}: 429 RESOURCE_EXHAUSTED (attempt {attempt}/{max_attempts}), "
+                  f"concurrency -> {limiter.limit}, sleeping {delay:.1f}s...")
+            await asyncio.sleep(delay)
+        else:
+            await limiter.on_success()
+            return result
 
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
 
-TARGET_REPO = os.environ.get("TARGET_REPO", "")
+@dataclass(frozen=True)
+class Config:
+    """Runtime settings, read from the environment once in main()."""
+
+    target_repo: str = ""
+    gemini_key: str = ""
+    github_token: Optional[str] = None
+    github_repo: Optional[str] = None
+    telegram_bot_token: Optional[str] = None
+    telegram_chat_id: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        env = os.environ
+        return cls(
+            target_repo=env.get("TARGET_REPO", ""),
+            gemini_key=env.get("GEMINI_API_KEY", ""),
+            github_token=env.get("GITHUB_TOKEN"),
+            github_repo=env.get("GITHUB_REPOSITORY"),
+            telegram_bot_token=env.get("TELEGRAM_BOT_TOKEN"),
+            telegram_chat_id=env.get("TELEGRAM_CHAT_ID"),
+        )
+
+
 COMIC_DIR = Path(__file__).resolve().parent.parent / "comic-strips"
+# Git-ignored; the workflow carries it between runs with actions/cache
+CACHE_DIR = COMIC_DIR / ".cache"
+ETAG_CACHE_PATH = CACHE_DIR / "etags.json"
 
 GEMINI_TEXT_MODEL = "gemini-2.0-flash"
 GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image"
 
+# Stitched panels are scaled down to at most this height
+MAX_PANEL_HEIGHT = 1024
+
+# Quality for JPEG strips / release assets
+JPEG_QUALITY = 85
+
+# Max panel image requests in flight at once (free-tier safe)
+MAX_CONCURRENT_PANELS = 3
+
 IMAGE_STYLE_PREFIX = (
     "Cartoon style, warm tones (coral, gold, cream), bold outlines, "
     "simple and clear, medieval fantasy village setting. "
 )
 
+# ---------------------------------------------------------------------------
+# Cache helpers
+# ---------------------------------------------------------------------------
+
+def cache_key(*parts: str) -> str:
+    """Stable content hash for an on-disk cache entry."""
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Write via a temp file + os.replace so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
 # ---------------------------------------------------------------------------
 # Step 1: Fetch commits
 # ---------------------------------------------------------------------------
 
-def fetch_commits(repo: str, date: Optional[str] = None) -> list[dict]:
-    """Fetch commits from GitHub API for a given date (YYYY-MM-DD).
+# Shared HTTP/2 client: paginated GitHub calls, release uploads and Telegram
+# all multiplex over pooled keep-alive connections
+_HTTP = httpx.Client(http2=True, timeout=30)
 
-    If date is None, uses yesterday. Returns list of {sha, message, author}.
-    """
-    if date is None:
-        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
-        date = yesterday.strftime("%Y-%m-%d")
+COMMITS_PER_PAGE = 100
+MAX_PAGE_WORKERS = 8
 
-    since = f"{date}T00:00:00Z"
-    until_date = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)
-    until = until_date.strftime("%Y-%m-%dT00:00:00Z")
 
-    url = f"https://api.github.com/repos/{repo}/commits"
+def github_headers(cfg: Config) -> dict:
+    """Standard GitHub REST headers, authenticated when GITHUB_TOKEN is set."""
     headers = {"Accept": "application/vnd.github+json"}
+    if cfg.github_token:
+        headers["Authorization"] = f"Bearer {cfg.github_token}"
+    return headers
+
+
+def load_etags() -> dict:
+    """Load cached {request key: {etag, commits, last_page}} entries, if any."""
+    try:
+        return orjson.loads(ETAG_CACHE_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
 
-    token = os.environ.get("GITHUB_TOKEN")
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-
-    commits = []
-    page = 1
-    while True:
-        resp = requests.get(
-            url,
-            headers=headers,
-            params={"since": since, "until": until, "per_page": 100, "page": page},
-        )
-        resp.raise_for_status()
-        batch = resp.json()
-        if not batch:
-            break
-        commits.extend(batch)
-        if len(batch) < 100:
-            break
-        page += 1
-
-    # Filter out merge commits, extract essentials
-    results = []
-    for c in commits:
-        msg = c["commit"]["message"].split("\n")[0]  # first line only
-        if msg.startswith("Merge pull request") or msg.startswith("Merge branch"):
-            continue
-        results.append({
-            "sha": c["sha"][:7],
-            "message": msg,
-            "author": c["commit"]["author"]["name"],
-        })
 
-    return results
+def commit_essentials(c: dict) -> dict:
+    """The fields we keep from a GitHub commit object."""
+    return {
+        "sha": c["sha"][:7],
+        "message": c["commit"]["message"].split("\n")[0],  # first line only
+        "author": c["commit"]["author"]["name"],
+    }
+
+
+def fetch_commits_page(url: str, headers: dict, params: dict, cached: Optional[dict]) -> dict:
+    """GET one page of commits with a conditional If-None-Match request.
+
+    Returns a cache entry {etag, commits, last_page, has_next}. On 304 Not
+    Modified the `cached` entry is returned as-is.
+    """
+    if cached:
+        headers = {**headers, "If-None-Match": cached["etag"]}
+
+    resp = _HTTP.get(url, headers=headers, params=params)
+    if resp.status_code == 304 and cached:
+        return cached
+    resp.raise_for_status()
+
+    last_page = params["page"]
+    if "last" in resp.links:
+        last_page = int(parse_qs(urlparse(resp.links["last"]["url"]).query)["page"][0])
+    return {
+        "etag": resp.headers.get("ETag"),
+        "commits": [commit_essentials(c) for c in resp.json()],
+        "last_page": last_page,
+        "has_next": "next" in resp.links,
+    }
+
+
+def fetch_commits(cfg: Config, day_start: Optional[datetime] = None) -> list[dict]:
+    """Fetch cfg.target_repo's commits for the UTC day starting at day_start.
+
+    If day_start is None, uses yesterday. Returns list of {sha, message, author}.
+    The first page's Link header gives the page count; remaining pages are
+    fetched in parallel. If a response has rel="next" but no rel="last", the
+    rest are followed serially so no commits are silently dropped. ETags are persisted so unchanged pages cost a 304;
+    only this run's pages are written back, so the file doesn't grow daily.
+    """
+    if day_start is None:
+        day_start = datetime.now(timezone.utc) - timedelta(days=1)
+
+    since = day_start.strftime("%Y-%m-%dT00:00:00Z")
+    until = (day_start + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00Z")
+
+    url = f"https://api.github.com/repos/{cfg.target_repo}/commits"
+    headers = github_headers(cfg)
+    etags = load_etags()
+
+    def fetch_page(page: int) -> tuple[str, dict]:
+        params = {"since": since, "until": until, "per_page": COMMITS_PER_PAGE, "page": page}
+        key = f"{url}?{urlencode(sorted(params.items()))}"
+        cached = etags.get(key)
+        if cached and "has_next" not in cached:
+            cached = None  # entry from an older cache format
+        return key, fetch_commits_page(url, headers, params, cached)
+
+    entries = [fetch_page(1)]
+    last_page = entries[0][1]["last_page"]
+    if last_page > 1:
+        with ThreadPoolExecutor(max_workers=min(MAX_PAGE_WORKERS, last_page - 1)) as ex:
+            entries.extend(ex.map(fetch_page, range(2, last_page + 1)))
+
+    # No rel="last" to size the fan-out: follow rel="next" one page at a time
+    while entries[-1][1]["has_next"]:
+        entries.append(fetch_page(len(entries) + 1))
+
+    atomic_write_bytes(ETAG_CACHE_PATH, orjson.dumps(
+        {key: entry for key, entry in entries if entry["etag"]}
+    ))
+
+    # Filter out merge commits
+    return [
+        c for _, entry in entries for c in entry["commits"]
+        if not (c["message"].startswith("Merge pull request") or c["message"].startswith("Merge branch"))
+    ]
 
 
 # ---------------------------------------------------------------------------
@@ -213,9 +383,72 @@ Example 5 (navbar redesign — 384 lines):
 """
 
 
-def generate_script(commits: list[dict], api_key: str) -> list[dict]:
-    """Use Gemini to generate a 4-panel comic script from commits."""
-    client = genai.Client(api_key=api_key)
+_JSON_DECODER = json.JSONDecoder()
+
+
+class PanelStreamParser:
+    """Pull complete panel objects out of a JSON array as it streams in.
+
+    feed() returns (index, panel) for each object completed by the new chunk;
+    `text` accumulates the whole response for the final, authoritative parse.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos: Optional[int] = None
+        self._count = 0
+
+    def feed(self, chunk: str) -> list[tuple[int, dict]]:
+        self.text += chunk
+        if self._pos is None:
+            start = self.text.find("[")
+            if start < 0:
+                return []
+            self._pos = start + 1
+
+        done = []
+        while True:
+            # Skip separators between array elements
+            while self._pos < len(self.text) and self.text[self._pos] in " \t\r\n,":
+                self._pos += 1
+            if self._pos >= len(self.text) or self.text[self._pos] != "{":
+                break
+            try:
+                panel, self._pos = _JSON_DECODER.raw_decode(self.text, self._pos)
+            except json.JSONDecodeError:
+                break  # object not complete yet
+            done.append((self._count, panel))
+            self._count += 1
+        return done
+
+
+# Finds the body of a ```json / ```JSON / bare ``` fence anywhere in the response
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+
+
+async def generate_script(
+    commits: list[dict],
+    client: genai.Client,
+    on_panel: Optional[Callable[[int, dict], None]] = None,
+    on_reset: Optional[Callable[[], None]] = None,
+) -> list[dict]:
+    """Use Gemini to generate a 4-panel comic script from commits.
+
+    The response is streamed; `on_panel(index, panel)` fires as soon as each
+    panel object is complete, so callers can start work before the rest of
+    the script arrives. `on_reset()` fires at the start of every streaming
+    attempt, so panels handed out by an attempt that was later retried can be
+    discarded. Responses are cached under CACHE_DIR keyed on the
+    prompt and commit SHAs, so workflow reruns for the same day skip the
+    Gemini call (and on_panel is not called).
+    """
+    key = cache_key(
+        GEMINI_TEXT_MODEL, SYSTEM_PROMPT, "\n".join(c["sha"] for c in commits)
+    )
+    cache_path = CACHE_DIR / f"{key}.json"
+    if cache_path.exists():
+        print(f"  Using cached script: {cache_path.name}")
+        return orjson.loads(cache_path.read_bytes())
 
     commit_list = "\n".join(
         f"- [{c['sha']}] {c['message']}" for c in commits
@@ -225,28 +458,36 @@ def generate_script(commits: list[dict], api_key: str) -> list[dict]:
         f"Create a 4-panel comic strip. Return ONLY the JSON array."
     )
 
-    response = call_gemini_with_retry(
-        lambda: client.models.generate_content(
+    async def _stream() -> str:
+        if on_reset is not None:
+            on_reset()
+        parser = PanelStreamParser()
+        stream = await client.aio.models.generate_content_stream(
             model=GEMINI_TEXT_MODEL,
             contents=user_msg,
             config=types.GenerateContentConfig(
                 system_instruction=SYSTEM_PROMPT,
                 response_mime_type="application/json",
             ),
-        ),
-        label="script generation",
+        )
+        async for chunk in stream:
+            for i, panel in parser.feed(chunk.text or ""):
+                if on_panel is not None:
+                    on_panel(i, panel)
+        return parser.text
+
+    text = await call_gemini_with_retry_async(
+        _stream, label="script generation", limiter=AdaptiveLimiter(1)
     )
-
-    text = response.text.strip()
-
-    # Strip markdown code fences if present
-    if text.startswith("```"):
-        text = text.split("\n", 1)[1]
-        text = text.rsplit("```", 1)[0]
-        text = text.strip()
-
-    panels = json.loads(text)
+    text = text.strip()
+    try:
+        panels = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # Strip markdown code fences if present
+        m = _FENCE_RE.search(text)
+        panels = orjson.loads(m.group(1) if m else text)
     assert isinstance(panels, list) and len(panels) == 4, f"Expected 4 panels, got {len(panels)}"
+    atomic_write_bytes(cache_path, orjson.dumps(panels))
     return panels
 
 
@@ -254,28 +495,58 @@ def generate_script(commits: list[dict], api_key: str) -> list[dict]:
 # Step 3: Generate panel images via Gemini
 # ---------------------------------------------------------------------------
 
-def generate_panel_image(panel: dict, output_path: Path, api_key: str) -> bool:
-    """Generate a single panel image using Gemini."""
-    client = genai.Client(api_key=api_key)
-
-    # Build the full prompt
+def panel_description(panel: dict) -> str:
+    """Title bar, scene and speech bubbles for one panel's image prompt."""
     bubble_text = " ".join(
         f'{b["speaker"]}: "{b["text"]}"' for b in panel["bubbles"]
     )
-    prompt = (
-        f"{IMAGE_STYLE_PREFIX}"
+    return (
         f"TOP TITLE BAR (black bar with white bold text): '{panel['title']}'. "
         f"{panel['scene']} "
         f"Speech bubbles: {bubble_text}"
     )
 
+
+def panel_cache_path(panel: dict) -> Path:
+    """On-disk cache location for a panel's image, keyed on its full prompt."""
+    prompt = f"{IMAGE_STYLE_PREFIX}{panel_description(panel)}"
+    return CACHE_DIR / "img" / f"{cache_key(GEMINI_IMAGE_MODEL, prompt)}.png"
+
+
+def response_images(response) -> list[bytes]:
+    """All inline image payloads in a Gemini response, in order."""
+    images = []
+    for part in response.candidates[0].content.parts:
+        if part.inline_data is not None:
+            image_data = part.inline_data.data
+            if isinstance(image_data, str):
+                image_data = base64.b64decode(image_data)
+            images.append(image_data)
+    return images
+
+
+async def generate_panel_image_async(
+    panel: dict, client: genai.Client, limiter: AdaptiveLimiter
+) -> Optional[bytes]:
+    """Generate a single panel image using Gemini via the shared client's aio surface.
+
+    Returns the encoded image bytes, or None if every attempt failed.
+    """
+    prompt = f"{IMAGE_STYLE_PREFIX}{panel_description(panel)}"
+
+    cache_path = panel_cache_path(panel)
+    if cache_path.exists():
+        print(f"  Cached: {panel['title'][:60]}")
+        return cache_path.read_bytes()
+
     print(f"  Generating: {panel['title'][:60]}...")
 
     max_retries = 3
     for attempt in range(max_retries):
+        backoff_base = 1.0
         try:
-            response = call_gemini_with_retry(
-                lambda: client.models.generate_content(
+            response = await call_gemini_with_retry_async(
+                lambda: client.aio.models.generate_content(
                     model=GEMINI_IMAGE_MODEL,
                     contents=prompt,
                     config=types.GenerateContentConfig(
@@ -283,70 +554,133 @@ def generate_panel_image(panel: dict, output_path: Path, api_key: str) -> bool:
                     ),
                 ),
                 label=f"panel image '{panel['title'][:40]}'",
+                limiter=limiter,
             )
 
-            for part in response.candidates[0].content.parts:
-                if part.inline_data is not None:
-                    image_data = part.inline_data.data
-                    if isinstance(image_data, str):
-                        image_data = base64.b64decode(image_data)
-                    output_path.write_bytes(image_data)
-                    print(f"  Saved: {output_path.name}")
-                    return True
+            images = response_images(response)
+            if images:
+                atomic_write_bytes(cache_path, images[0])
+                print(f"  Done: {panel['title'][:60]}")
+                return images[0]
 
             print(f"  No image in response (attempt {attempt + 1})")
         except Exception as e:
             print(f"  Error (attempt {attempt + 1}): {e}")
+            if is_rate_limited(e):
+                backoff_base = 10.0
 
         if attempt < max_retries - 1:
-            time.sleep(5)
+            await asyncio.sleep(backoff_delay(attempt, base=backoff_base))
+
+    return None
 
-    return False
 
+async def generate_comic(
+    commits: list[dict],
+    client: genai.Client,
+    max_concurrent: int = MAX_CONCURRENT_PANELS,
+) -> tuple[list[dict], list[bytes]]:
+    """Write the script and draw its panels, overlapping the two steps.
 
-def generate_all_panels(panels: list[dict], tmp_dir: Path, api_key: str) -> list[Path]:
-    """Generate images for all 4 panels. Returns list of image paths."""
-    paths = []
+    Each panel's image request starts as soon as that panel streams out of
+    the script, so wall time is roughly max(script, images) rather than the
+    sum; a cached script starts all panels at once. An adaptive limiter caps
+    in-flight image requests so we stay under the per-minute quota, backing
+    off further whenever Gemini answers 429. Returns the script and the
+    images that succeeded, in panel order.
+    """
+    limiter = AdaptiveLimiter(max_concurrent)
+    # index -> (panel the image was started for, its task)
+    tasks: dict[int, tuple[dict, asyncio.Task]] = {}
+
+    def start_panel(i: int, panel: dict):
+        if i in tasks and tasks[i][0] != panel:
+            tasks.pop(i)[1].cancel()
+        if i not in tasks:
+            task = asyncio.create_task(generate_panel_image_async(panel, client, limiter))
+            tasks[i] = (panel, task)
+
+    def reset_panels():
+        # A retried stream is a fresh script; drop images for the old one
+        for _, task in tasks.values():
+            task.cancel()
+        tasks.clear()
+
+    panels = await generate_script(
+        commits, client, on_panel=start_panel, on_reset=reset_panels
+    )
+    print(f"  Generated {len(panels)} panels:")
+    for i, p in enumerate(panels):
+        print(f"  Panel {i+1}: {p['title']}")
+
+    # Start anything the stream parser didn't hand over (all of them for a
+    # cached script), and restart any image whose panel differs from the
+    # final parsed script
     for i, panel in enumerate(panels):
-        output = tmp_dir / f"panel_{i + 1}.png"
-        success = generate_panel_image(panel, output, api_key)
-        if not success:
+        start_panel(i, panel)
+    results = await asyncio.gather(*(tasks[i][1] for i in range(len(panels))))
+
+    images = []
+    for i, image_data in enumerate(results):
+        if image_data is None:
             print(f"  FAILED to generate panel {i + 1}, skipping")
-            continue
-        paths.append(output)
-        # Small delay between requests to avoid rate limits
-        if i < len(panels) - 1:
-            time.sleep(2)
-    return paths
+        else:
+            images.append(image_data)
+    return panels, images
 
 
 # ---------------------------------------------------------------------------
 # Step 4: Stitch panels horizontally
 # ---------------------------------------------------------------------------
 
-def stitch_panels(panel_paths: list[Path], output_path: Path, gap: int = 20) -> Path:
-    """Stitch panel images horizontally with a gap between them."""
-    images = [Image.open(p) for p in panel_paths]
+def decode_rgb(data: bytes) -> Image.Image:
+    """Fully decode an in-memory panel image as RGB."""
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img.convert("RGB")
+
 
-    # Normalize to same height (use the max height)
-    max_height = max(img.height for img in images)
-    resized = []
-    for img in images:
-        if img.height != max_height:
-            ratio = max_height / img.height
-            new_width = int(img.width * ratio)
-            img = img.resize((new_width, max_height), Image.LANCZOS)
-        resized.append(img)
+def fit_height(img: Image.Image, height: int) -> Image.Image:
+    """Scale an image to `height`, keeping its aspect ratio."""
+    if img.height > height:
+        img.thumbnail((10_000, height), Image.LANCZOS)
+    elif img.height < height:
+        ratio = height / img.height
+        new_width = int(img.width * ratio)
+        img = img.resize((new_width, height), Image.LANCZOS)
+    return img
+
+
+def stitch_panels(
+    panel_images: list[bytes], output_path: Path, gap: int = 20, output_format: str = "PNG"
+) -> Path:
+    """Stitch encoded panel images horizontally with a gap between them.
+
+    output_format="JPEG" writes the final strip as JPEG (quality 85) so the
+    release upload can use it as-is instead of re-encoding the PNG.
+    """
+    # Pillow releases the GIL while decoding/resampling, so fan out per panel
+    with ThreadPoolExecutor(max_workers=len(panel_images)) as ex:
+        images = list(ex.map(decode_rgb, panel_images))
+
+        # Normalize to same height: the tallest panel, capped at MAX_PANEL_HEIGHT
+        max_height = min(MAX_PANEL_HEIGHT, max(img.height for img in images))
+        resized = list(ex.map(lambda img: fit_height(img, max_height), images))
 
     total_width = sum(img.width for img in resized) + gap * (len(resized) - 1)
-    canvas = Image.new("RGB", (total_width, max_height), (255, 255, 255))
 
+    # One white buffer; each panel is a single slab copy into its column range
+    out = np.full((max_height, total_width, 3), 255, dtype=np.uint8)
     x = 0
     for img in resized:
-        canvas.paste(img, (x, 0))
-        x += img.width + gap
+        arr = np.asarray(img)
+        out[:, x:x + arr.shape[1]] = arr
+        x += arr.shape[1] + gap
 
-    canvas.save(output_path, "PNG")
+    if output_format == "JPEG":
+        Image.fromarray(out).save(output_path, "JPEG", quality=JPEG_QUALITY)
+    else:
+        Image.fromarray(out).save(output_path, "PNG")
     print(f"Stitched {len(resized)} panels -> {output_path}")
     return output_path
 
@@ -356,8 +690,12 @@ def stitch_panels(panel_paths: list[Path], output_path: Path, gap: int = 20) ->
 # ---------------------------------------------------------------------------
 
 def open_file(path: Path):
-    """Open a file with the system default viewer."""
+    """Open a file with the system default viewer (skipped on CI / headless Linux)."""
     system = platform.system()
+    if os.environ.get("CI") or os.environ.get("GITHUB_ACTIONS"):
+        return
+    if system == "Linux" and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        return
     try:
         if system == "Darwin":
             subprocess.run(["open", str(path)], check=True)
@@ -369,93 +707,132 @@ def open_file(path: Path):
         pass  # Don't fail if open doesn't work (e.g. headless CI)
 
 
-def upload_image_as_release(image_path: Path, date: str) -> Optional[str]:
+def upload_image_as_release(cfg: Config, image_path: Path, date: str) -> Optional[str]:
     """Compress PNG to JPEG and upload as a GitHub Release asset.
 
+    A strip already stitched as .jpg is uploaded as-is, skipping the re-encode;
+    a PNG is compressed in memory so nothing extra lands in comic-strips/.
     Returns the release asset download URL, which renders in issue markdown
     for anyone with repo access (works for private repos).
     """
-    # Compress PNG to JPEG
-    jpeg_path = image_path.with_suffix(".jpg")
-    try:
-        img = Image.open(image_path)
-        img.convert("RGB").save(jpeg_path, "JPEG", quality=85)
-        print(f"  Compressed {image_path.name} -> {jpeg_path.name} "
-              f"({jpeg_path.stat().st_size / 1024 / 1024:.1f}MB)")
-    except Exception as e:
-        print(f"  Compression failed: {e}")
-        return None
+    asset_name = image_path.with_suffix(".jpg").name
+    if image_path.suffix == ".jpg":
+        jpeg_bytes = image_path.read_bytes()
+    else:
+        # Compress PNG to JPEG
+        try:
+            buf = io.BytesIO()
+            Image.open(image_path).convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY)
+            jpeg_bytes = buf.getvalue()
+            print(f"  Compressed {image_path.name} -> {asset_name} "
+                  f"({len(jpeg_bytes) / 1024 / 1024:.1f}MB)")
+        except Exception as e:
+            print(f"  Compression failed: {e}")
+            return None
 
     tag = f"comic-{date}"
 
-    # Create release and upload asset via gh CLI
+    if not cfg.github_token:
+        print("  GITHUB_TOKEN not set, cannot create release")
+        return None
+
+    # Create a draft release, upload the asset, then publish. The tag only
+    # exists once published, and a failed upload deletes the draft, so a
+    # rerun never trips over a half-made release holding comic-{date}.
+    releases_url = f"https://api.github.com/repos/{cfg.github_repo}/releases"
     try:
-        result = subprocess.run(
-            ["gh", "release", "create", tag, str(jpeg_path),
-             "--title", f"Daily Comic {date}",
-             "--notes", f"Auto-generated comic strip for {date}"],
-            capture_output=True, text=True,
+        resp = _HTTP.post(
+            releases_url,
+            headers=github_headers(cfg),
+            json={
+                "tag_name": tag,
+                "name": f"Daily Comic {date}",
+                "body": f"Auto-generated comic strip for {date}",
+                "draft": True,
+            },
         )
-        if result.returncode != 0:
-            print(f"  Release creation failed: {result.stderr.strip()}")
+        if not resp.is_success:
+            print(f"  Release creation failed: {resp.status_code} {resp.text.strip()}")
             return None
+        release = resp.json()
+    except Exception as e:
+        print(f"  Release creation error: {e}")
+        return None
 
-        # Get the asset download URL
-        result = subprocess.run(
-            ["gh", "release", "view", tag, "--json", "assets",
-             "--jq", ".assets[0].url"],
-            capture_output=True, text=True, check=True,
+    try:
+        # upload_url is a URI template: ".../assets{?name,label}"
+        upload_url = release["upload_url"].split("{", 1)[0]
+        resp = _HTTP.post(
+            upload_url,
+            headers={**github_headers(cfg), "Content-Type": "image/jpeg"},
+            params={"name": asset_name},
+            content=jpeg_bytes,
         )
-        asset_url = result.stdout.strip()
-        if asset_url:
-            print(f"  Release asset URL: {asset_url}")
-            return asset_url
+        resp.raise_for_status()
+
+        resp = _HTTP.patch(
+            f"{releases_url}/{release['id']}",
+            headers=github_headers(cfg),
+            json={"draft": False},
+        )
+        resp.raise_for_status()
+        # Draft asset URLs point at an untagged path; read the published one
+        asset_url = resp.json()["assets"][0]["browser_download_url"]
+        print(f"  Release asset URL: {asset_url}")
+        return asset_url
     except Exception as e:
         print(f"  Release upload error: {e}")
+        try:
+            _HTTP.delete(f"{releases_url}/{release['id']}", headers=github_headers(cfg))
+        except Exception as cleanup_error:
+            print(f"  Could not delete draft release: {cleanup_error}")
 
     return None
 
 
-def create_github_issue(date: str, panels: list[dict], commits: list[dict]):
-    """Create a GitHub Issue with the comic image and panel dialogue."""
-    gh_repo = os.environ.get("GITHUB_REPOSITORY", "")
-    if not gh_repo:
+def iter_issue_body_lines(date: str, image_url: str, panels: list[dict], commits: list[dict]):
+    """Yield the markdown lines of the daily issue body."""
+    yield f"![Daily Comic — {date}]({image_url})"
+    yield ""
+    yield "---"
+    yield ""
+
+    for i, panel in enumerate(panels):
+        yield f"### Panel {i + 1}: {panel['title']}"
+        for bubble in panel.get("bubbles", []):
+            yield f"> **{bubble['speaker']}**: {bubble['text']}"
+        yield ""
+
+    yield "---"
+    yield f"*{len(commits)} commits summarized into 4 panels.*"
+
+
+def create_github_issue(
+    cfg: Config, date: str, panels: list[dict], commits: list[dict], image_name: str
+):
+    """Create a GitHub Issue with the comic image and panel dialogue.
+
+    `image_name` is the committed strip in COMIC_DIR (<date>.png, or .jpg
+    when generated with --jpeg), as recorded in the saved script JSON.
+    """
+    if not cfg.github_repo:
         print("WARNING: GITHUB_REPOSITORY not set, skipping issue creation")
         return
 
     # Upload image as release asset (works for private repos)
-    image_path = COMIC_DIR / f"{date}.png"
+    image_path = COMIC_DIR / image_name
     image_url = None
     if image_path.exists():
         print("Uploading comic image as release asset...")
-        image_url = upload_image_as_release(image_path, date)
+        image_url = upload_image_as_release(cfg, image_path, date)
 
     # Fallback to raw.githubusercontent.com (only works for public repos)
     if not image_url:
         print("  Falling back to raw.githubusercontent.com URL")
-        image_url = f"https://raw.githubusercontent.com/{gh_repo}/main/comic-strips/{date}.png"
-
-    # Build the issue body
-    body_lines = [
-        f"![Daily Comic — {date}]({image_url})",
-        "",
-        "---",
-        "",
-    ]
-
-    for i, panel in enumerate(panels):
-        body_lines.append(f"### Panel {i + 1}: {panel['title']}")
-        for bubble in panel.get("bubbles", []):
-            body_lines.append(f"> **{bubble['speaker']}**: {bubble['text']}")
-        body_lines.append("")
-
-    body_lines.extend([
-        "---",
-        f"*{len(commits)} commits summarized into 4 panels.*",
-    ])
+        image_url = f"https://raw.githubusercontent.com/{cfg.github_repo}/main/comic-strips/{image_path.name}"
 
     title = f"Daily Comic — {date} — {len(commits)} commits"
-    body = "\n".join(body_lines)
+    body = "\n".join(iter_issue_body_lines(date, image_url, panels, commits))
 
     try:
         subprocess.run(
@@ -469,10 +846,10 @@ def create_github_issue(date: str, panels: list[dict], commits: list[dict]):
         print(f"WARNING: Failed to create issue: {e}")
 
 
-def send_telegram(image_path: Path, date: str, panels: list[dict], commits: list[dict]):
+def send_telegram(cfg: Config, image_path: Path, date: str, panels: list[dict], commits: list[dict]):
     """Send the comic strip to Telegram via Bot API."""
-    token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
+    token = cfg.telegram_bot_token
+    chat_id = cfg.telegram_chat_id
     if not token or not chat_id:
         print("WARNING: TELEGRAM_BOT_TOKEN or TELEGRAM_CHAT_ID not set, skipping Telegram")
         return
@@ -489,9 +866,9 @@ def send_telegram(image_path: Path, date: str, panels: list[dict], commits: list
 
     url = f"https://api.telegram.org/bot{token}/sendDocument"
     with open(image_path, "rb") as f:
-        resp = requests.post(url, data={"chat_id": chat_id, "caption": caption}, files={"document": f})
+        resp = _HTTP.post(url, data={"chat_id": chat_id, "caption": caption}, files={"document": f})
 
-    if resp.ok:
+    if resp.is_success:
         print(f"Sent comic to Telegram chat {chat_id}")
     else:
         print(f"WARNING: Telegram send failed: {resp.status_code} {resp.text}")
@@ -501,16 +878,21 @@ def send_telegram(image_path: Path, date: str, panels: list[dict], commits: list
 # Main
 # ---------------------------------------------------------------------------
 
-def main():
+def main(cfg: Optional[Config] = None):
+    if cfg is None:
+        cfg = Config.from_env()
+
     parser = argparse.ArgumentParser(description="Daily Comic Strip Generator")
     parser.add_argument("date", nargs="?", default=None, help="Date in YYYY-MM-DD format (defaults to yesterday)")
     parser.add_argument("--create-issue", action="store_true", help="Create a GitHub Issue from saved JSON (run after commit+push)")
+    parser.add_argument("--jpeg", action="store_true", help="Save the stitched strip as JPEG (uploaded as-is by --create-issue)")
     args = parser.parse_args()
 
-    date = args.date
-    if date is None:
-        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
-        date = yesterday.strftime("%Y-%m-%d")
+    if args.date is None:
+        day_start = datetime.now(timezone.utc) - timedelta(days=1)
+    else:
+        day_start = datetime.fromisoformat(args.date).replace(tzinfo=timezone.utc)
+    date = day_start.strftime("%Y-%m-%d")
 
     # --create-issue: read from saved JSON, create issue, and exit
     if args.create_issue:
@@ -518,29 +900,32 @@ def main():
         if not script_path.exists():
             print(f"No comic JSON found for {date}, skipping issue creation")
             sys.exit(0)
-        with open(script_path) as f:
-            data = json.load(f)
-        create_github_issue(data["date"], data["panels"], data["commits"])
+        data = orjson.loads(script_path.read_bytes())
+        create_github_issue(
+            cfg, data["date"], data["panels"], data["commits"],
+            image_name=data.get("image", f"{data['date']}.png"),
+        )
         sys.exit(0)
 
     print(f"=== Daily Comic Generator — {date} ===\n")
 
     # Required env vars
-    gemini_key = os.environ.get("GEMINI_API_KEY")
-    if not gemini_key:
+    if not cfg.gemini_key:
         print("ERROR: GEMINI_API_KEY not set")
         print("Get one free at https://aistudio.google.com/app/apikey")
         sys.exit(1)
 
-    repo = os.environ.get("TARGET_REPO", TARGET_REPO)
-    if not repo:
+    if not cfg.target_repo:
         print("ERROR: TARGET_REPO not set")
         print("Set it to owner/repo (e.g. TARGET_REPO=octocat/hello-world)")
         sys.exit(1)
 
+    # One client for the whole run so its connection pool is reused
+    client = genai.Client(api_key=cfg.gemini_key)
+
     # Step 1: Fetch commits
-    print(f"[1/4] Fetching commits from {repo}...")
-    commits = fetch_commits(repo, date)
+    print(f"[1/4] Fetching commits from {cfg.target_repo}...")
+    commits = fetch_commits(cfg, day_start)
     print(f"  Found {len(commits)} commits\n")
 
     if not commits:
@@ -551,40 +936,36 @@ def main():
         print(f"  {c['sha']} {c['message']}")
     print()
 
-    # Step 2: Generate script
-    print("[2/4] Generating comic script via Gemini...")
-    panels = generate_script(commits, gemini_key)
-    print(f"  Generated {len(panels)} panels:")
-    for i, p in enumerate(panels):
-        print(f"  Panel {i+1}: {p['title']}")
-    print()
-
-    # Step 3: Generate images
-    print("[3/4] Generating panel images via Gemini...")
-    with tempfile.TemporaryDirectory() as tmp:
-        tmp_dir = Path(tmp)
-        panel_paths = generate_all_panels(panels, tmp_dir, gemini_key)
+    # Steps 2+3: Generate script and images (panels start as they stream in)
+    print("[2-3/4] Generating comic script and panel images via Gemini...")
+    panels, panel_images = asyncio.run(generate_comic(commits, client))
 
-        if len(panel_paths) < 2:
-            print("ERROR: Fewer than 2 panels generated. Aborting.")
-            sys.exit(1)
-        print()
+    if len(panel_images) < 2:
+        print("ERROR: Fewer than 2 panels generated. Aborting.")
+        sys.exit(1)
+    print()
 
-        # Step 4: Stitch
-        print("[4/4] Stitching panels...")
-        COMIC_DIR.mkdir(parents=True, exist_ok=True)
+    # Step 4: Stitch
+    print("[4/4] Stitching panels...")
+    COMIC_DIR.mkdir(parents=True, exist_ok=True)
+    if args.jpeg:
+        output_path = COMIC_DIR / f"{date}.jpg"
+        stitch_panels(panel_images, output_path, output_format="JPEG")
+    else:
         output_path = COMIC_DIR / f"{date}.png"
-        stitch_panels(panel_paths, output_path)
-        print()
+        stitch_panels(panel_images, output_path)
+    print()
 
     # Save script alongside image for reference
     script_path = COMIC_DIR / f"{date}.json"
-    with open(script_path, "w") as f:
-        json.dump({"date": date, "commits": commits, "panels": panels}, f, indent=2)
+    script_path.write_bytes(orjson.dumps(
+        {"date": date, "image": output_path.name, "commits": commits, "panels": panels},
+        option=orjson.OPT_INDENT_2,
+    ))
     print(f"Saved script: {script_path}")
 
     # Send to Telegram
-    send_telegram(output_path, date, panels, commits)
+    send_telegram(cfg, output_path, date, panels, commits)
 
     print(f"\nDone! Comic saved to {output_path}")
     open_file(output_path)